@@ -1,36 +1,99 @@
 """
 Module for connecting to Binance WebSocket API and receiving orderbook data
 """
-import json
+import asyncio
 import logging
+import msgspec
 import requests
 import threading
 import time
-import websocket
-from typing import Callable, Dict, List, Optional
+import numpy as np
+import websockets
+import xxhash
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    from uvloop import new_event_loop
+except ImportError:  # uvloop is not available on Windows
+    from asyncio import new_event_loop
+
+from symbol_state import SymbolState
 
 logger = logging.getLogger(__name__)
 
 
+class DepthUpdate(msgspec.Struct):
+    """
+    Orderbook depth data, as sent by depth20@100ms stream and REST depth endpoint:
+    {"lastUpdateId":123456789,"bids":[[price,qty],...],"asks":[[price,qty],...]}
+    """
+    lastUpdateId: int
+    bids: List[Tuple[float, float]]
+    asks: List[Tuple[float, float]]
+
+
+class CombinedStreamMessage(msgspec.Struct):
+    """Combined stream envelope: {"stream": "<symbol>@depth20@100ms", "data": {...}}"""
+    stream: str
+    data: DepthUpdate
+
+
+# Schema-aware decoders; strict=False parses Binance price/qty strings straight to float
+_depth_decoder = msgspec.json.Decoder(DepthUpdate, strict=False)
+_stream_decoder = msgspec.json.Decoder(CombinedStreamMessage, strict=False)
+
+
 class BinanceWebSocketClient:
     """Client for working with Binance WebSocket API"""
     
     REST_API_URL = "https://api.binance.com/api/v3/depth"
+    TOP_LEVELS = 20  # Depth of depth20 stream and of data passed to handler
+    SNAPSHOT_WORKERS = 8  # Parallel REST requests for initial snapshots
     
-    def __init__(self, symbols: List[str], on_message_callback: Callable):
+    def __init__(
+        self,
+        symbols: List[str],
+        on_message_callback: Callable,
+        state: Optional[Dict[str, SymbolState]] = None
+    ):
         """
         Initialize WebSocket client
         
         Args:
             symbols: List of symbols to monitor
             on_message_callback: Callback function for processing messages
+            state: Per-symbol state shared with other components (created if not given)
         """
         self.symbols = symbols
         self.on_message_callback = on_message_callback
         self.is_running = False
-        self.orderbooks: Dict[str, Dict] = {}  # Store current orderbook state
-        self.last_sent_data: Dict[str, Dict] = {}  # Store last sent data for change detection
-        self.last_sent_time: Dict[str, float] = {}  # Time of last data send
+        # Event loop for all stream I/O (uvloop if available), run forever in one daemon thread
+        self.loop = new_event_loop()
+        self._stream_future = None
+        # Persistent HTTP session, reuses TLS connections across REST calls
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=2))
+        # Orderbook and change detection state per symbol
+        self.state: Dict[str, SymbolState] = state if state is not None else {}
+        for symbol in symbols:
+            self._reset_symbol(symbol)
+        self._empty_update_warned: Set[str] = set()  # Symbols already warned about empty updates
+    
+    def _reset_symbol(self, symbol: str) -> SymbolState:
+        """Create empty top levels state for symbol"""
+        st = self.state.get(symbol)
+        if st is None:
+            st = self.state[symbol] = SymbolState()
+        # Preallocated contiguous float64 buffers of prices and quantities per side,
+        # and views into them covering the currently filled top levels
+        st.top_buffers = {
+            name: np.zeros(self.TOP_LEVELS, dtype=np.float64)
+            for name in ('bid_prices', 'bid_qtys', 'ask_prices', 'ask_qtys')
+        }
+        st.top_levels = {name: buf[:0] for name, buf in st.top_buffers.items()}
+        return st
     
     def _get_initial_snapshot(self, symbol: str) -> Optional[Dict]:
         """Get initial orderbook snapshot via REST API"""
@@ -39,208 +102,171 @@ class BinanceWebSocketClient:
                 'symbol': symbol,
                 'limit': 20  # Get top 20 to match WebSocket
             }
-            response = requests.get(self.REST_API_URL, params=params, timeout=5)
+            response = self._session.get(self.REST_API_URL, params=params, timeout=5)
             response.raise_for_status()
-            data = response.json()
+            data = _depth_decoder.decode(response.content)
             
             return {
                 'symbol': symbol,
-                'bids': data.get('bids', []),
-                'asks': data.get('asks', [])
+                'bids': data.bids,
+                'asks': data.asks
             }
         except Exception as e:
-            logger.error(f"Error getting snapshot for {symbol}: {e}")
+            logger.error("Error getting snapshot for %s: %s", symbol, e)
             return None
     
     def start(self):
-        """Start WebSocket connection for all symbols"""
+        """Start combined WebSocket connection for all symbols"""
         # First get initial snapshots for all symbols
-        logger.info(f"Getting initial orderbook snapshots for {len(self.symbols)} symbols...")
+        logger.info("Getting initial orderbook snapshots for %d symbols...", len(self.symbols))
         self.is_running = True
-        for symbol in self.symbols:
-            logger.info(f"Getting snapshot for {symbol}...")
-            snapshot = self._get_initial_snapshot(symbol)
+        # Fetch snapshots in parallel, process them in symbol order
+        with ThreadPoolExecutor(max_workers=self.SNAPSHOT_WORKERS) as executor:
+            snapshots = list(executor.map(self._get_initial_snapshot, self.symbols))
+        for symbol, snapshot in zip(self.symbols, snapshots):
             if snapshot:
-                self.orderbooks[symbol] = {
-                    'bids': {float(price): float(qty) for price, qty in snapshot['bids']},
-                    'asks': {float(price): float(qty) for price, qty in snapshot['asks']}
-                }
+                self._reset_symbol(symbol)
+                top = self._update_orderbook(symbol, snapshot['bids'], snapshot['asks']).top_levels
                 # Send initial snapshot to handler
-                self.on_message_callback({
-                    'symbol': symbol,
-                    'bids': snapshot['bids'],
-                    'asks': snapshot['asks']
-                })
-                logger.info(f"✅ Snapshot received for {symbol}: {len(snapshot['bids'])} bids, {len(snapshot['asks'])} asks")
+                self.on_message_callback({'symbol': symbol, **top})
+                logger.info(
+                    "✅ Snapshot received for %s: %d bids, %d asks",
+                    symbol, len(snapshot['bids']), len(snapshot['asks'])
+                )
             else:
-                logger.error(f"❌ Failed to get snapshot for {symbol}")
+                logger.error("❌ Failed to get snapshot for %s", symbol)
         
-        # Use combined stream for updates
-        def start_single_stream(symbol: str):
-            """Start WebSocket for single symbol"""
-            stream_name = f"{symbol.lower()}@depth20@100ms"
-            url = f"wss://stream.binance.com:9443/ws/{stream_name}"
-            
-            logger.info(f"🔌 Connecting to {symbol}: {url}")
-            
-            def on_open_local(ws):
-                logger.info(f"✅ WebSocket connected for {symbol}")
-            
-            def on_error_local(ws, error):
-                logger.error(f"❌ WebSocket error for {symbol}: {error}")
-            
-            def on_close_local(ws, close_status_code, close_msg):
-                logger.warning(f"⚠️ WebSocket closed for {symbol}: {close_status_code} - {close_msg}")
-                # Don't auto-reconnect to avoid recursion
-                # Reconnection can be added in the future via separate mechanism
-            
-            def on_message(ws, message):
-                try:
-                    data = json.loads(message)
-                    # Log connection (only first time for diagnostics)
-                    if not hasattr(on_message, '_log_count'):
-                        on_message._log_count = {}
-                    if symbol not in on_message._log_count:
-                        logger.info(f"✅ Connected to WebSocket for {symbol}")
-                        on_message._log_count[symbol] = 0
+        # Use one combined stream connection for all symbols
+        stream_symbols = {f"{symbol.lower()}@depth20@100ms": symbol for symbol in self.symbols}
+        url = "wss://stream.binance.com:9443/stream?streams=" + "/".join(stream_symbols)
+        
+        logger.info("🔌 Connecting to combined stream for %d symbols: %s", len(self.symbols), url)
+        
+        def on_message(message):
+            symbol = None
+            try:
+                message_data = _stream_decoder.decode(message)
+                # Route message to its symbol by stream name
+                symbol = stream_symbols.get(message_data.stream)
+                if symbol is None:
+                    return
+                data = message_data.data
+                
+                # Update local orderbook
+                st = self._update_orderbook(symbol, data.bids, data.asks)
+                
+                # Send updated data to handler only if data exists
+                top = st.top_levels
+                if len(top['bid_prices']) > 0 and len(top['ask_prices']) > 0:
+                    current_time = time.time()
+                    time_since_last = current_time - st.last_sent_time
                     
-                    # Update local orderbook
-                    self._update_orderbook(symbol, data)
+                    # Strategy: send data if:
+                    # 1. First time for symbol
+                    # 2. 5+ seconds passed (reasonable interval for monitoring)
+                    # 3. Or data actually changed (compare signature of top 10)
+                    # xxh3 reads the contiguous float64 buffers directly, no bytes copies
+                    hasher = xxhash.xxh3_64(top['bid_prices'][:10])
+                    hasher.update(top['bid_qtys'][:10])
+                    hasher.update(top['ask_prices'][:10])
+                    hasher.update(top['ask_qtys'][:10])
+                    sig = hasher.intdigest()
                     
-                    # Send updated data to handler only if data exists
-                    if symbol in self.orderbooks and len(self.orderbooks[symbol]['bids']) > 0:
-                        orderbook = self.orderbooks[symbol]
-                        # Get top 20 bids and asks
-                        top_bids = sorted(orderbook['bids'].items(), reverse=True)[:20]
-                        top_asks = sorted(orderbook['asks'].items())[:20]
-                        
-                        if top_bids and top_asks:
-                            # Format data for sending
-                            current_data = {
-                                'symbol': symbol,
-                                'bids': [[str(p), str(q)] for p, q in top_bids],
-                                'asks': [[str(p), str(q)] for p, q in top_asks]
-                            }
-                            
-                            current_time = time.time()
-                            last_time = self.last_sent_time.get(symbol, 0)
-                            time_since_last = current_time - last_time
-                            
-                            # Strategy: send data if:
-                            # 1. First time for symbol
-                            # 2. 5+ seconds passed (reasonable interval for monitoring)
-                            # 3. Or data actually changed (compare top 10)
-                            should_send = False
-                            
-                            if symbol not in self.last_sent_data:
-                                # First time - always send
-                                should_send = True
-                            else:
-                                # Check if data changed (compare top 10)
-                                last_data = self.last_sent_data.get(symbol)
-                                if last_data:
-                                    # Compare top 10 bids and asks
-                                    last_top_bids = last_data.get('bids', [])[:10]
-                                    last_top_asks = last_data.get('asks', [])[:10]
-                                    current_top_bids = current_data['bids'][:10]
-                                    current_top_asks = current_data['asks'][:10]
-                                    
-                                    # Check if data changed
-                                    if last_top_bids != current_top_bids or last_top_asks != current_top_asks:
-                                        should_send = True
-                                
-                                # If data didn't change but 5+ seconds passed - send for freshness
-                                if not should_send and time_since_last >= 5.0:
-                                    should_send = True
-                            
-                            # Send if needed
-                            if should_send:
-                                self.last_sent_data[symbol] = current_data.copy()
-                                self.last_sent_time[symbol] = current_time
-                                self.on_message_callback(current_data)
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON decode error for {symbol}: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing message for {symbol}: {e}", exc_info=True)
-            
-            ws = websocket.WebSocketApp(
-                url,
-                on_message=on_message,
-                on_error=on_error_local,
-                on_close=on_close_local,
-                on_open=on_open_local
-            )
-            
-            ws.run_forever()
+                    # Send if needed (no stored signature on first time)
+                    if sig != st.last_sent_sig or time_since_last >= 5.0:
+                        st.last_sent_sig = sig
+                        st.last_sent_time = current_time
+                        self.on_message_callback({'symbol': symbol, **top})
+            except msgspec.DecodeError as e:
+                # Symbol is unknown until decode succeeds, log start of raw message instead
+                logger.error("JSON decode error: %s (message: %r)", e, message[:200])
+            except Exception as e:
+                logger.error("Error processing message for %s: %s", symbol, e, exc_info=True)
+        
+        async def handle_stream():
+            try:
+                async with websockets.connect(url) as ws:
+                    logger.info("✅ WebSocket connected for %s", ', '.join(self.symbols))
+                    while True:
+                        # Raw bytes go straight to the decoder, skipping UTF-8 decode to str
+                        on_message(await ws.recv(decode=False))
+            except websockets.ConnectionClosed as e:
+                logger.warning("⚠️ WebSocket closed: %s", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ WebSocket error: %s", e)
+            # Don't auto-reconnect
+            # Reconnection can be added in the future via separate mechanism
         
-        # Start separate thread for each symbol
-        # Use daemon threads - they automatically terminate when main thread ends
-        logger.info("🚀 Starting WebSocket streams...")
-        for symbol in self.symbols:
-            thread = threading.Thread(target=start_single_stream, args=(symbol,), daemon=True)
+        # Start event loop in single daemon thread
+        # Daemon thread automatically terminates when main thread ends
+        logger.info("🚀 Starting WebSocket stream...")
+        self._stream_future = asyncio.run_coroutine_threadsafe(handle_stream(), self.loop)
+        if not self.loop.is_running():
+            thread = threading.Thread(target=self.loop.run_forever, daemon=True)
             thread.start()
-            logger.info(f"✅ Stream started for {symbol}")
-            # Don't call join() - threads run in background
-            # Main thread continues execution
+        # Don't call join() - thread runs in background
+        # Main thread continues execution
         
-        logger.info("✅ All WebSocket streams started, main thread continues execution")
+        logger.info("✅ WebSocket stream started, main thread continues execution")
     
-    def _update_orderbook(self, symbol: str, update_data: Dict):
-        """Update local orderbook based on delta updates"""
-        if symbol not in self.orderbooks:
-            self.orderbooks[symbol] = {'bids': {}, 'asks': {}}
+    def _update_orderbook(
+        self,
+        symbol: str,
+        bids_data: List[Tuple[float, float]],
+        asks_data: List[Tuple[float, float]]
+    ) -> SymbolState:
+        """
+        Replace top levels with levels from a depth frame
         
-        orderbook = self.orderbooks[symbol]
+        Binance WebSocket depth20@100ms sends a complete top-20 snapshot in every
+        frame (see DepthUpdate), NOT standard depthUpdate deltas, with each side
+        already sorted best-first, so the frame is copied straight into buffers
         
-        # Check data format
-        # Binance WebSocket depth20@100ms sends data in format:
-        # {"lastUpdateId":123456789,"bids":[[price,qty],...],"asks":[[price,qty],...]}
-        # This is NOT standard depthUpdate format, but snapshot-like format
-        bids_data = update_data.get('bids', update_data.get('b', []))
-        asks_data = update_data.get('asks', update_data.get('a', []))
+        Args:
+            symbol: Symbol ticker
+            bids_data: Bids as (price, qty) float pairs
+            asks_data: Asks as (price, qty) float pairs
+            
+        Returns:
+            Updated symbol state
+        """
+        st = self.state.get(symbol)
+        if st is None or not st.top_buffers:
+            st = self._reset_symbol(symbol)
         
-        # Minimal logging - only if empty update (error)
+        # Minimal logging - only if empty update (error); keep current book
         if len(bids_data) == 0 and len(asks_data) == 0:
-            if not hasattr(self, '_empty_update_warned'):
-                self._empty_update_warned = set()
             if symbol not in self._empty_update_warned:
-                logger.warning(
-                    f"⚠️ {symbol}: empty delta update! "
-                    f"Keys in data: {list(update_data.keys())}"
-                )
+                logger.warning("⚠️ %s: empty depth update!", symbol)
                 self._empty_update_warned.add(symbol)
+            return st
         
-        # Update bids
-        for price, qty in bids_data:
-            try:
-                price_f = float(price)
-                qty_f = float(qty)
-                if qty_f == 0:
-                    # Remove order
-                    orderbook['bids'].pop(price_f, None)
-                else:
-                    # Add or update order
-                    orderbook['bids'][price_f] = qty_f
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error processing bid for {symbol}: price={price}, qty={qty}, error={e}")
+        # Fill top levels buffers of both sides so handlers get contiguous numeric data
+        # (zero quantity levels are skipped)
+        for prefix, levels in (('bid', bids_data), ('ask', asks_data)):
+            prices_buf = st.top_buffers[prefix + '_prices']
+            qtys_buf = st.top_buffers[prefix + '_qtys']
+            count = 0
+            for price, qty in levels:
+                if qty != 0:
+                    prices_buf[count] = price
+                    qtys_buf[count] = qty
+                    count += 1
+                    if count == self.TOP_LEVELS:
+                        break
+            st.top_levels[prefix + '_prices'] = prices_buf[:count]
+            st.top_levels[prefix + '_qtys'] = qtys_buf[:count]
         
-        # Update asks
-        for price, qty in asks_data:
-            try:
-                price_f = float(price)
-                qty_f = float(qty)
-                if qty_f == 0:
-                    # Remove order
-                    orderbook['asks'].pop(price_f, None)
-                else:
-                    # Add or update order
-                    orderbook['asks'][price_f] = qty_f
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error processing ask for {symbol}: price={price}, qty={qty}, error={e}")
+        return st
     
     def stop(self):
         """Stop WebSocket connection"""
         self.is_running = False
+        if self._stream_future:
+            self._stream_future.cancel()
+        self._session.close()
         logger.info("WebSocket connection stopped")
 
 
@@ -249,25 +275,31 @@ def parse_orderbook_data(data: Dict) -> Optional[Dict]:
     Parse orderbook data (data is already processed in BinanceWebSocketClient)
     
     Args:
-        data: Data from WebSocket (already processed)
+        data: Data from WebSocket (already processed), with bid_prices, bid_qtys,
+            ask_prices and ask_qtys as contiguous 1-D float64 arrays, best first
         
     Returns:
-        Dictionary with symbol, bids and asks, or None if error
+        Dictionary with symbol and the four price/quantity arrays, or None if error
     """
     try:
         symbol = data.get('symbol')
-        bids = data.get('bids', [])
-        asks = data.get('asks', [])
+        bid_prices = data.get('bid_prices')
+        bid_qtys = data.get('bid_qtys')
+        ask_prices = data.get('ask_prices')
+        ask_qtys = data.get('ask_qtys')
         
-        if not symbol or not bids or not asks:
+        if not symbol or bid_prices is None or bid_qtys is None or ask_prices is None or ask_qtys is None:
+            return None
+        if len(bid_prices) == 0 or len(ask_prices) == 0:
             return None
         
         return {
             'symbol': symbol,
-            'bids': bids,
-            'asks': asks
+            'bid_prices': bid_prices,
+            'bid_qtys': bid_qtys,
+            'ask_prices': ask_prices,
+            'ask_qtys': ask_qtys
         }
     except Exception as e:
-        logger.error(f"Error parsing orderbook data: {e}")
+        logger.error("Error parsing orderbook data: %s", e)
         return None
-
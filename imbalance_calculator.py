@@ -2,51 +2,78 @@
 Module for calculating Imbalance Ratio based on orderbook data
 """
 import logging
-from typing import Dict, List, Optional
+import math
+from typing import Dict, Optional
+
+import numpy as np
+from numba import njit
 
 logger = logging.getLogger(__name__)
 
 
+@njit(cache=True, fastmath=True)
+def _imbalance_kernel(
+    bid_prices: np.ndarray,
+    bid_qtys: np.ndarray,
+    ask_prices: np.ndarray,
+    ask_qtys: np.ndarray
+) -> float:
+    """
+    Compiled Imbalance Ratio kernel
+    
+    Returns:
+        Imbalance Ratio, or NaN if total volume is zero
+    """
+    bid_volume = 0.0
+    for i in range(bid_prices.shape[0]):
+        bid_volume += bid_prices[i] * bid_qtys[i]
+    
+    ask_volume = 0.0
+    for i in range(ask_prices.shape[0]):
+        ask_volume += ask_prices[i] * ask_qtys[i]
+    
+    total_volume = bid_volume + ask_volume
+    if total_volume == 0.0:
+        return np.nan
+    
+    return (bid_volume - ask_volume) / total_volume
+
+
 def calculate_imbalance_ratio(
-    bids: List[List[str]], 
-    asks: List[List[str]], 
+    bid_prices: np.ndarray, 
+    bid_qtys: np.ndarray, 
+    ask_prices: np.ndarray, 
+    ask_qtys: np.ndarray, 
     top_n: int = 10
 ) -> Optional[float]:
     """
     Calculate Imbalance Ratio based on top N bids and asks
     
     Args:
-        bids: List of bids in format [[price, quantity], ...]
-        asks: List of asks in format [[price, quantity], ...]
+        bid_prices: Bid prices as contiguous float64 array, best first
+        bid_qtys: Bid quantities as contiguous float64 array
+        ask_prices: Ask prices as contiguous float64 array, best first
+        ask_qtys: Ask quantities as contiguous float64 array
         top_n: Number of top orders for calculation (default 10)
         
     Returns:
         Imbalance Ratio or None if error
     """
     try:
-        # Get top N bids and asks
-        top_bids = bids[:top_n] if len(bids) >= top_n else bids
-        top_asks = asks[:top_n] if len(asks) >= top_n else asks
-        
-        # Calculate total volume for bids
-        bid_volume = sum(float(price) * float(quantity) for price, quantity in top_bids)
-        
-        # Calculate total volume for asks
-        ask_volume = sum(float(price) * float(quantity) for price, quantity in top_asks)
-        
-        # Check for division by zero
-        total_volume = bid_volume + ask_volume
-        if total_volume == 0:
+        # Calculate Imbalance Ratio on top N levels (NaN means zero total volume)
+        # Slices of contiguous 1-D buffers stay contiguous, so no copies are made
+        imbalance_ratio = _imbalance_kernel(
+            bid_prices[:top_n], bid_qtys[:top_n],
+            ask_prices[:top_n], ask_qtys[:top_n]
+        )
+        if math.isnan(imbalance_ratio):
             logger.warning("Total volume is zero, cannot calculate Imbalance Ratio")
             return None
         
-        # Calculate Imbalance Ratio
-        imbalance_ratio = (bid_volume - ask_volume) / total_volume
-        
         return imbalance_ratio
         
     except (ValueError, TypeError, IndexError) as e:
-        logger.error(f"Error calculating Imbalance Ratio: {e}")
+        logger.error("Error calculating Imbalance Ratio: %s", e)
         return None
 
 
@@ -55,7 +82,8 @@ def process_orderbook(orderbook_data: Dict, top_n: int = 10) -> Optional[Dict]:
     Process orderbook data and calculate Imbalance Ratio
     
     Args:
-        orderbook_data: Orderbook data with symbol, bids and asks
+        orderbook_data: Orderbook data with symbol, bid_prices, bid_qtys,
+            ask_prices and ask_qtys (contiguous float64 arrays)
         top_n: Number of top orders for calculation
         
     Returns:
@@ -63,14 +91,19 @@ def process_orderbook(orderbook_data: Dict, top_n: int = 10) -> Optional[Dict]:
     """
     try:
         symbol = orderbook_data.get('symbol')
-        bids = orderbook_data.get('bids', [])
-        asks = orderbook_data.get('asks', [])
+        bid_prices = orderbook_data.get('bid_prices')
+        bid_qtys = orderbook_data.get('bid_qtys')
+        ask_prices = orderbook_data.get('ask_prices')
+        ask_qtys = orderbook_data.get('ask_qtys')
         
-        if not symbol or not bids or not asks:
-            logger.warning(f"Insufficient data for processing: symbol={symbol}")
+        if (not symbol or bid_prices is None or bid_qtys is None or ask_prices is None
+                or ask_qtys is None or len(bid_prices) == 0 or len(ask_prices) == 0):
+            logger.warning("Insufficient data for processing: symbol=%s", symbol)
             return None
         
-        imbalance_ratio = calculate_imbalance_ratio(bids, asks, top_n)
+        imbalance_ratio = calculate_imbalance_ratio(
+            bid_prices, bid_qtys, ask_prices, ask_qtys, top_n
+        )
         
         if imbalance_ratio is None:
             return None
@@ -78,11 +111,11 @@ def process_orderbook(orderbook_data: Dict, top_n: int = 10) -> Optional[Dict]:
         return {
             'symbol': symbol,
             'imbalance_ratio': imbalance_ratio,
-            'bids_count': len(bids),
-            'asks_count': len(asks)
+            'bids_count': len(bid_prices),
+            'asks_count': len(ask_prices)
         }
         
     except Exception as e:
-        logger.error(f"Error processing orderbook: {e}")
+        logger.error("Error processing orderbook: %s", e)
         return None
 
@@ -4,6 +4,7 @@ Main module for integrating all components of the Imbalance Ratio monitoring sys
 import logging
 import signal
 import sys
+import threading
 import time
 from typing import Dict, Optional
 
@@ -16,6 +17,7 @@ from config import (
 )
 from binance_client import BinanceWebSocketClient, parse_orderbook_data
 from imbalance_calculator import process_orderbook
+from symbol_state import SymbolState
 from telegram_notifier import TelegramNotifier
 
 # Logging configuration
@@ -36,16 +38,18 @@ class ImbalanceMonitor:
     
     def __init__(self):
         """Initialize monitor"""
+        # Per-symbol state shared with WebSocket client and Telegram notifier
+        self.state: Dict[str, SymbolState] = {symbol: SymbolState() for symbol in SYMBOLS}
         self.telegram_notifier = TelegramNotifier(
             TELEGRAM_BOT_TOKEN, 
             TELEGRAM_CHAT_ID,
-            IMBALANCE_THRESHOLD
+            IMBALANCE_THRESHOLD,
+            state=self.state
         )
         self.binance_client: Optional[BinanceWebSocketClient] = None
         self.is_running = False
-        self.last_imbalance_ratios: Dict[str, float] = {}  # Store last values
-        self.last_notification_time: Dict[str, float] = {}  # Time of last notification
         self.periodic_notification_interval = 30.0  # Interval for periodic notifications (seconds)
+        self._threshold_abs = abs(float(IMBALANCE_THRESHOLD))  # Precomputed for hot path
         
         # Validate configuration
         self._validate_config()
@@ -62,7 +66,7 @@ class ImbalanceMonitor:
             logger.error("Symbol list is empty")
             raise ValueError("At least one symbol must be specified")
         
-        logger.info(f"Configuration loaded: threshold={IMBALANCE_THRESHOLD}, symbols={SYMBOLS}")
+        logger.info("Configuration loaded: threshold=%s, symbols=%s", IMBALANCE_THRESHOLD, SYMBOLS)
     
     def _handle_orderbook_update(self, data: Dict):
         """
@@ -93,66 +97,44 @@ class ImbalanceMonitor:
             
             # Check if value changed (with minimum threshold for sensitivity)
             # Use threshold 0.0001 (0.01%) to detect even small changes
-            last_ratio = self.last_imbalance_ratios.get(symbol)
-            if last_ratio is None:
-                ratio_changed = True
-            else:
-                try:
-                    current_ratio = float(imbalance_ratio)
-                    last_ratio_val = float(last_ratio)
-                    diff = abs(current_ratio - last_ratio_val)
-                    ratio_changed = diff > 0.0001
-                except (TypeError, ValueError):
-                    ratio_changed = True
+            # Producer guarantees float values, so no conversions are needed
+            st = self.state[symbol]
+            last_ratio = st.last_ratio
+            ratio_changed = last_ratio is None or abs(imbalance_ratio - last_ratio) > 0.0001
             
             # Check notification condition
-            try:
-                imbalance_ratio_val = float(imbalance_ratio)
-                threshold_val = abs(float(IMBALANCE_THRESHOLD))
-                exceeds_threshold = abs(imbalance_ratio_val) > threshold_val
-            except (TypeError, ValueError):
-                return
-            
-            if exceeds_threshold:
-                current_time = time.time()
-                last_notif_time = self.last_notification_time.get(symbol, 0)
-                time_since_last = current_time - last_notif_time
+            if abs(imbalance_ratio) > self._threshold_abs:
+                time_since_last = time.time() - st.last_notif_time
                 
                 # Send notification if:
                 # 1. Value changed (ratio_changed), OR
                 # 2. Enough time passed since last notification (periodic_notification_interval)
                 should_send = ratio_changed or time_since_last >= self.periodic_notification_interval
                 
-                if should_send:
-                    # Send notification to Telegram
-                    notification_sent = self.telegram_notifier.send_notification(symbol, imbalance_ratio_val)
-                    
-                    if notification_sent:
-                        # Update last notification time and value ONLY after successful send
-                        self.last_notification_time[symbol] = current_time
-                        self.last_imbalance_ratios[symbol] = imbalance_ratio_val
-                        # Format change information for log
-                        if last_ratio is not None:
-                            last_ratio_val = float(last_ratio)
-                            change_info = f"{last_ratio_val:.4f} → {imbalance_ratio_val:.4f}"
-                        else:
-                            change_info = f"N/A → {imbalance_ratio_val:.4f}"
+                # If value didn't change and not enough time passed
+                # DON'T update last_ratio - keep old value for proper change detection
+                # (notifier records notification time when it accepts the alert)
+                if should_send and self.telegram_notifier.send_notification(symbol, imbalance_ratio):
+                    # Update last value ONLY after notification is accepted
+                    st.last_ratio = imbalance_ratio
+                    # Change information for log (N/A on first notification)
+                    if last_ratio is None:
+                        logger.info(
+                            "✅ Notification queued for %s: |%.4f| > %.4f (change: N/A → %.4f)",
+                            symbol, imbalance_ratio, self._threshold_abs, imbalance_ratio
+                        )
+                    else:
                         logger.info(
-                            f"✅ Notification sent for {symbol}: "
-                            f"|{imbalance_ratio_val:.4f}| > {threshold_val:.4f} "
-                            f"(change: {change_info})"
+                            "✅ Notification queued for %s: |%.4f| > %.4f (change: %.4f → %.4f)",
+                            symbol, imbalance_ratio, self._threshold_abs, last_ratio, imbalance_ratio
                         )
-                else:
-                    # Value didn't change and not enough time passed
-                    # DON'T update last_imbalance_ratios - keep old value for proper change detection
-                    pass
             else:
                 # Doesn't exceed threshold - update value for change tracking
                 # This allows detecting when value exceeds threshold again
-                self.last_imbalance_ratios[symbol] = imbalance_ratio_val
+                st.last_ratio = imbalance_ratio
                 
         except Exception as e:
-            logger.error("Error processing orderbook update: " + str(e), exc_info=True)
+            logger.error("Error processing orderbook update: %s", e, exc_info=True)
     
     def start(self):
         """Start monitoring"""
@@ -162,8 +144,11 @@ class ImbalanceMonitor:
             # Create and start Binance WebSocket client
             self.binance_client = BinanceWebSocketClient(
                 symbols=SYMBOLS,
-                on_message_callback=self._handle_orderbook_update
+                on_message_callback=self._handle_orderbook_update,
+                state=self.state
             )
+            # Send Telegram messages on the same event loop as the WebSocket stream
+            self.telegram_notifier.attach_loop(self.binance_client.loop)
             
             self.is_running = True
             
@@ -174,7 +159,7 @@ class ImbalanceMonitor:
             logger.info("Received interrupt signal, stopping monitoring...")
             self.stop()
         except Exception as e:
-            logger.error(f"Critical error: {e}", exc_info=True)
+            logger.error("Critical error: %s", e, exc_info=True)
             self.stop()
             sys.exit(1)
     
@@ -189,10 +174,14 @@ class ImbalanceMonitor:
         logger.info("Monitoring stopped")
 
 
+# Set by signal handler to stop the main thread wait
+stop_event = threading.Event()
+
+
 def signal_handler(sig, frame):
     """Signal handler for graceful shutdown"""
     logger.info("Received shutdown signal")
-    sys.exit(0)
+    stop_event.set()
 
 
 def main():
@@ -205,16 +194,21 @@ def main():
     monitor = ImbalanceMonitor()
     monitor.start()
     
-    # Main thread must run indefinitely
+    # Main thread must run until shutdown signal
     # so daemon threads don't terminate
+    # Only stop_event.is_set() is checked here, it takes no lock,
+    # so setting the event from the signal handler can't deadlock
     logger.info("✅ Monitor started, waiting for updates...")
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info("Received shutdown signal")
-        monitor.stop()
-        sys.exit(0)
+    if sys.platform == "win32":
+        # Windows has no signal.pause(), wake up once per second to check for shutdown
+        while not stop_event.is_set():
+            time.sleep(1.0)
+    else:
+        # Sleep until a signal arrives: no periodic wakeups
+        while not stop_event.is_set():
+            signal.pause()
+    
+    monitor.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,34 @@
+"""
+Module with per-symbol state shared by WebSocket client, monitor and notifier
+"""
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class SymbolState:
+    """State of one symbol, kept in a single object so hot paths do one dict lookup per tick"""
+    
+    __slots__ = (
+        'top_buffers',
+        'top_levels',
+        'last_sent_sig',
+        'last_sent_time',
+        'last_ratio',
+        'last_notif_time',
+        'last_notif_value'
+    )
+    
+    def __init__(self):
+        """Initialize empty state"""
+        # WebSocket client: top levels passed to handler
+        # (bid_prices, bid_qtys, ask_prices, ask_qtys as contiguous 1-D buffers)
+        self.top_buffers: Dict[str, np.ndarray] = {}
+        self.top_levels: Dict[str, np.ndarray] = {}
+        self.last_sent_sig: Optional[int] = None  # Signature of last sent top 10
+        self.last_sent_time = 0.0  # Time of last data send
+        # Monitor: last tracked Imbalance Ratio
+        self.last_ratio: Optional[float] = None
+        # Notifier: time and value of last notification
+        self.last_notif_time = 0.0
+        self.last_notif_value: Optional[float] = None
@@ -2,20 +2,39 @@
 Module for sending notifications via Telegram bot
 """
 import asyncio
-import datetime
 import logging
+import threading
 import time
-from typing import Dict, Optional
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
 from telegram import Bot
 from telegram.error import TelegramError
 
+try:
+    from uvloop import new_event_loop
+except ImportError:  # uvloop is not available on Windows
+    from asyncio import new_event_loop
+
+from symbol_state import SymbolState
+
 logger = logging.getLogger(__name__)
 
+# Queued alert: symbol, ratio, queue time, previous notification time and value
+_Alert = Tuple[str, float, float, float, Optional[float]]
+
 
 class TelegramNotifier:
     """Class for sending Telegram notifications"""
     
-    def __init__(self, bot_token: str, chat_id: str, threshold: float = 0.5):
+    MAX_MESSAGE_LENGTH = 4096  # Telegram limit for message text
+    
+    def __init__(
+        self,
+        bot_token: str,
+        chat_id: str,
+        threshold: float = 0.5,
+        state: Optional[Dict[str, SymbolState]] = None
+    ):
         """
         Initialize Telegram notifier
         
@@ -23,59 +42,100 @@ class TelegramNotifier:
             bot_token: Telegram bot token
             chat_id: Chat ID for sending messages
             threshold: Alert threshold
+            state: Per-symbol state shared with other components (created if not given)
         """
         self.bot_token = bot_token
         self.chat_id = chat_id
         self.threshold = threshold
         self.bot: Optional[Bot] = None
-        self.last_notification_time: Dict[str, float] = {}
-        self.last_notification_value: Dict[str, float] = {}  # Store last value
+        # Time and value of last notification per symbol
+        self.state: Dict[str, SymbolState] = state if state is not None else {}
         self.notification_cooldown = 10  # Spam protection: 10 seconds between messages for one symbol
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # Shared event loop for sending
+        self.batch_window = 0.25  # Alerts within this window (seconds) are sent as one message
+        self._pending: Deque[_Alert] = deque()  # Alerts waiting for flush
+        self._flush_scheduled = False
+        self._msg_templates: Dict[str, str] = {}  # Per-symbol message templates
+        self._send_tasks: Set[asyncio.Task] = set()  # Strong references to running send tasks
+    
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        Send messages on an existing event loop (e.g. the WebSocket client loop)
+        
+        Args:
+            loop: Event loop running in a background thread
+        """
+        self.loop = loop
+    
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Get event loop for sending, starting a persistent one if none attached"""
+        if self.loop is None:
+            self.loop = new_event_loop()
+            thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            thread.start()
+        return self.loop
         
-    def _initialize_bot(self):
-        """Initialize Telegram bot"""
+    async def _initialize_bot(self):
+        """Initialize Telegram bot (once, so its HTTP connection pool is reused)"""
         if not self.bot:
             try:
-                self.bot = Bot(token=self.bot_token)
+                bot = Bot(token=self.bot_token)
+                await bot.initialize()
+                self.bot = bot
                 logger.info("Telegram bot initialized")
             except Exception as e:
-                logger.error(f"Error initializing Telegram bot: {e}")
+                logger.error("Error initializing Telegram bot: %s", e)
                 raise
     
-    def _format_message(self, symbol: str, imbalance_ratio: float, threshold: float) -> str:
+    def _message_template(self, symbol: str) -> str:
+        """
+        Get message template for symbol, built once with symbol and threshold filled in
+        
+        Args:
+            symbol: Symbol ticker
+            
+        Returns:
+            Template with {ratio}, {direction} and {time} fields
+        """
+        template = self._msg_templates.get(symbol)
+        if template is None:
+            # Format symbol for display (BTCUSDT -> BTC/USDT)
+            display_symbol = symbol.replace('USDT', '/USDT')
+            # Doubled braces stay as fields filled in by _format_message
+            template = (
+                f"⚠️ Imbalance Alert\n\n"
+                f"Symbol: {display_symbol}\n"
+                f"Imbalance Ratio: {{ratio:.4f}}\n"
+                f"Direction: {{direction}}\n"
+                f"Threshold: |{{ratio:.4f}}| > {abs(self.threshold):.4f}\n"
+                f"Time: {{time}}"
+            )
+            self._msg_templates[symbol] = template
+        return template
+    
+    def _format_message(self, symbol: str, imbalance_ratio: float, current_time: str) -> str:
         """
         Format message for Telegram
         
         Args:
             symbol: Symbol ticker
             imbalance_ratio: Imbalance Ratio value
-            threshold: Alert threshold
+            current_time: Event time as HH:MM:SS
             
         Returns:
             Formatted message
         """
-        # Format symbol for display (BTCUSDT -> BTC/USDT)
-        display_symbol = symbol.replace('USDT', '/USDT')
-        
         # Determine imbalance direction
         if imbalance_ratio > 0:
             direction = "🟢 Buyers advantage"
         else:
             direction = "🔴 Sellers advantage"
         
-        # Event time
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-        
-        message = (
-            f"⚠️ Imbalance Alert\n\n"
-            f"Symbol: {display_symbol}\n"
-            f"Imbalance Ratio: {imbalance_ratio:.4f}\n"
-            f"Direction: {direction}\n"
-            f"Threshold: |{imbalance_ratio:.4f}| > {abs(threshold):.4f}\n"
-            f"Time: {current_time}"
+        return self._message_template(symbol).format(
+            ratio=imbalance_ratio,
+            direction=direction,
+            time=current_time
         )
-        
-        return message
     
     async def _send_message_async(self, message: str) -> bool:
         """
@@ -88,17 +148,17 @@ class TelegramNotifier:
             True if message sent successfully, False otherwise
         """
         try:
-            self._initialize_bot()
+            await self._initialize_bot()
             await self.bot.send_message(
                 chat_id=self.chat_id,
                 text=message
             )
             return True
         except TelegramError as e:
-            logger.error(f"Error sending Telegram message: {e}")
+            logger.error("Error sending Telegram message: %s", e)
             return False
         except Exception as e:
-            logger.error(f"Unexpected error sending message: {e}")
+            logger.error("Unexpected error sending message: %s", e)
             return False
     
     def send_notification(self, symbol: str, imbalance_ratio: float) -> bool:
@@ -110,15 +170,17 @@ class TelegramNotifier:
             imbalance_ratio: Imbalance Ratio value
             
         Returns:
-            True if notification sent, False otherwise
+            True if notification queued for sending, False otherwise
         """
         # Spam protection check
         current_time = time.time()
-        last_time = self.last_notification_time.get(symbol, 0)
-        last_value = self.last_notification_value.get(symbol)
+        st = self.state.get(symbol)
+        if st is None:
+            st = self.state[symbol] = SymbolState()
+        last_value = st.last_notif_value
         
         # Cooldown check
-        if current_time - last_time < self.notification_cooldown:
+        if current_time - st.last_notif_time < self.notification_cooldown:
             return False
         
         # Check if value changed (to avoid spamming same values)
@@ -128,25 +190,68 @@ class TelegramNotifier:
             if value_diff < 0.0005:  # Reduced threshold to 0.0005 for higher sensitivity
                 return False
         
-        # Format and send message
-        message = self._format_message(symbol, imbalance_ratio, self.threshold)
+        # Queue alert; alerts arriving within batch_window are sent as one message
+        # Previous notification state is kept so it can be restored if sending fails
+        self._pending.append((symbol, imbalance_ratio, current_time, st.last_notif_time, last_value))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # Schedule on persistent loop without blocking the caller
+            # (the caller may be running on that loop itself)
+            loop = self._get_loop()
+            loop.call_soon_threadsafe(loop.call_later, self.batch_window, self._flush)
         
-        # Use asyncio for sending
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        success = loop.run_until_complete(self._send_message_async(message))
-        
-        if success:
-            self.last_notification_time[symbol] = current_time
-            self.last_notification_value[symbol] = imbalance_ratio
-            logger.info(
-                f"Notification sent for {symbol}: "
-                f"Imbalance Ratio = {imbalance_ratio:.4f} (threshold: {self.threshold:.4f})"
-            )
+        st.last_notif_time = current_time
+        st.last_notif_value = imbalance_ratio
+        logger.info(
+            "Notification queued for %s: Imbalance Ratio = %.4f (threshold: %.4f)",
+            symbol, imbalance_ratio, self.threshold
+        )
         
-        return success
+        return True
+    
+    def _flush(self):
+        """Drain pending alerts and send them combined (runs on the event loop)"""
+        self._flush_scheduled = False
+        alerts: List[_Alert] = []
+        while self._pending:
+            alerts.append(self._pending.popleft())
+        if not alerts:
+            return
+        
+        # Combine alerts into as few messages as Telegram length limit allows
+        current_time = time.strftime("%H:%M:%S")
+        messages: List[Tuple[str, List[_Alert]]] = []
+        for alert in alerts:
+            text = self._format_message(alert[0], alert[1], current_time)
+            if messages and len(messages[-1][0]) + 2 + len(text) <= self.MAX_MESSAGE_LENGTH:
+                combined, combined_alerts = messages[-1]
+                combined_alerts.append(alert)
+                messages[-1] = (combined + "\n\n" + text, combined_alerts)
+            else:
+                messages.append((text, [alert]))
+        
+        # Event loop keeps only weak references to tasks, hold them until done
+        task = self.loop.create_task(self._send_messages_async(messages))
+        self._send_tasks.add(task)
+        task.add_done_callback(self._send_tasks.discard)
+    
+    async def _send_messages_async(self, messages: List[Tuple[str, List[_Alert]]]):
+        """
+        Send messages one by one, preserving order
+        
+        Notification time and value of alerts whose message failed to send are
+        rolled back, so the next alert for the symbol is not blocked by cooldown
+        
+        Args:
+            messages: Message texts with the alerts combined into each
+        """
+        for message, alerts in messages:
+            if await self._send_message_async(message):
+                continue
+            for symbol, imbalance_ratio, queued_time, prev_time, prev_value in alerts:
+                st = self.state[symbol]
+                # Skip if a newer notification was queued for symbol meanwhile
+                if st.last_notif_time == queued_time and st.last_notif_value == imbalance_ratio:
+                    st.last_notif_time = prev_time
+                    st.last_notif_value = prev_value
 